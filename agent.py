@@ -1,48 +1,135 @@
 import os
+import re
+import sys
+import json
+import asyncio
+import hashlib
 import logging
+import functools
+import threading
 import google.cloud.logging
+from dataclasses import dataclass
+from typing import AsyncGenerator, Callable, TextIO
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 # Import ADK libraries
 from google.adk import Agent
-from google.adk.agents import SequentialAgent, LoopAgent, ParallelAgent
+from google.adk.agents import BaseAgent, SequentialAgent, LoopAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.events import Event, EventActions
+from google.adk.sessions.state import State
 from google.adk.tools.tool_context import ToolContext
-from google.adk.tools.langchain_tool import LangchainTool
 from google.adk.models import Gemini
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
 from google.adk.tools import exit_loop
+from google.adk.runners import InMemoryRunner
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.genai import types
 
-# Import LangChain & Wikipedia libraries
-from langchain_community.tools import WikipediaQueryRun
-from langchain_community.utilities import WikipediaAPIWrapper
-
 # 1. SETUP & CONFIGURATION
 
-# Load .env
-if os.path.exists("parent_and_subagents/.env"):
-    load_dotenv("parent_and_subagents/.env")
-elif os.path.exists(".env"):
-    load_dotenv(".env")
-
-# Config variables
-use_vertex = os.getenv("GOOGLE_GENAI_USE_VERTEXAI")
-project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
-location = os.getenv("GOOGLE_CLOUD_LOCATION")
-model_name = os.getenv("MODEL", "gemini-1.5-flash")
-api_key = os.getenv("GOOGLE_API_KEY")
-
-RETRY_OPTIONS = types.HttpRetryOptions(initial_delay=1, attempts=6)
-
-def get_gemini_model():
-    if use_vertex and use_vertex.upper() == "TRUE" and project_id and location:
-        print(f"Using Vertex AI (Project: {project_id}, Loc: {location})")
-        return Gemini(model=model_name, vertexai=True, project=project_id, location=location, retry_options=RETRY_OPTIONS)
-    elif api_key:
+# Load .env (load_dotenv returns False when the file is missing or empty)
+load_dotenv("parent_and_subagents/.env") or load_dotenv(".env")
+
+# Config variables, read from the environment once
+@dataclass(frozen=True, slots=True)
+class Cfg:
+    use_vertex: bool
+    project_id: str | None
+    location: str | None
+    model_name: str
+    fast_model_name: str
+    api_key: str | None
+    verdict_batch: bool
+
+CFG = Cfg(
+    use_vertex=os.getenv("GOOGLE_GENAI_USE_VERTEXAI", "").upper() == "TRUE",
+    project_id=os.getenv("GOOGLE_CLOUD_PROJECT"),
+    location=os.getenv("GOOGLE_CLOUD_LOCATION"),
+    model_name=os.getenv("MODEL", "gemini-1.5-flash"),
+    fast_model_name=os.getenv("FAST_MODEL", "gemini-1.5-flash-8b"),
+    api_key=os.getenv("GOOGLE_API_KEY"),
+    verdict_batch=os.getenv("VERDICT_BATCH") == "1",
+)
+
+# Jittered exponential back-off (0.5s, 1s, 2s... capped at 8s) so one slow retry
+# doesn't stretch the whole trial
+RETRY_OPTIONS = types.HttpRetryOptions(initial_delay=0.5, attempts=4, exp_base=2.0, max_delay=8.0, jitter=0.3)
+
+# Poll while the job is in one of these; any other state is terminal
+BATCH_RUNNING_STATES = {
+    types.JobState.JOB_STATE_QUEUED,
+    types.JobState.JOB_STATE_PENDING,
+    types.JobState.JOB_STATE_RUNNING,
+    types.JobState.JOB_STATE_UPDATING,
+    types.JobState.JOB_STATE_CANCELLING,
+}
+BATCH_OK_STATES = {
+    types.JobState.JOB_STATE_SUCCEEDED,
+    types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED,
+}
+
+class BatchGemini(Gemini):
+    """Gemini that submits each request as an inline Batch API job and polls for the result.
+
+    Batch pricing is about half the live endpoint, at the cost of minutes of latency.
+    Inline batch requests are only supported by the Gemini Developer API (API key),
+    so get_gemini_model refuses to build one for Vertex AI. Jobs still running after
+    `timeout` seconds are cancelled.
+    """
+    poll_interval: float = 30.0
+    timeout: float = 3600.0
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        await self._preprocess_request(llm_request)
+        self._maybe_append_user_content(llm_request)
+        job = await self.api_client.aio.batches.create(
+            model=llm_request.model or self.model,
+            src=[types.InlinedRequest(contents=llm_request.contents, config=llm_request.config)],
+        )
+        logging.info(f"[Batch] Submitted {job.name}")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        while job.state in BATCH_RUNNING_STATES:
+            if loop.time() >= deadline:
+                await self.api_client.aio.batches.cancel(name=job.name)
+                raise TimeoutError(f"Batch job {job.name} still {job.state} after {self.timeout:.0f}s; cancelled")
+            await asyncio.sleep(self.poll_interval)
+            job = await self.api_client.aio.batches.get(name=job.name)
+
+        if job.state not in BATCH_OK_STATES:
+            raise RuntimeError(f"Batch job {job.name} ended with {job.state}")
+        result = job.dest.inlined_responses[0]
+        if result.error:
+            raise RuntimeError(f"Batch job {job.name} failed: {result.error.message}")
+        yield LlmResponse.create(result.response)
+
+def get_gemini_model(model_name, model_cls=Gemini):
+    if issubclass(model_cls, BatchGemini) and CFG.use_vertex:
+        raise ValueError("VERDICT_BATCH=1 needs an API key: inline batch jobs aren't supported on Vertex AI")
+    if CFG.use_vertex and CFG.project_id and CFG.location:
+        print(f"Using Vertex AI (Project: {CFG.project_id}, Loc: {CFG.location})")
+        return model_cls(model=model_name, vertexai=True, project=CFG.project_id, location=CFG.location, retry_options=RETRY_OPTIONS)
+    elif CFG.api_key:
         print("Using Standard API Key")
-        return Gemini(model=model_name, api_key=api_key, retry_options=RETRY_OPTIONS)
+        return model_cls(model=model_name, api_key=CFG.api_key, retry_options=RETRY_OPTIONS)
     else:
         raise ValueError("Missing Configuration! Check .env")
 
+# Routing, searching and judging are simple jobs for a small model (one instance, and
+# one HTTP client, shared by those agents). Only the final report uses the main model.
+FAST_MODEL = get_gemini_model(CFG.fast_model_name)
+
+# The verdict is written after the user has their answer, so it can go through
+# the cheaper Batch API when VERDICT_BATCH=1. The live agents stay on FAST_MODEL.
+SMART_MODEL = get_gemini_model(CFG.model_name, BatchGemini if CFG.verdict_batch else Gemini)
+
 # Setup Logging
 try:
     cloud_logging_client = google.cloud.logging.Client()
@@ -52,97 +139,277 @@ except Exception:
 
 # 2.TOOLS DEFINITION
 
+@functools.cache
+def _get_wiki_tool():
+    """Builds the Wikipedia search tool on first use, since LangChain is slow to import."""
+    import requests_cache
+    import wikipedia
+    from requests.adapters import HTTPAdapter
+    from langchain_community.tools import WikipediaQueryRun
+    from langchain_community.utilities import WikipediaAPIWrapper
+
+    # One pooled, cached session so TLS handshakes are reused and repeated
+    # article fetches are served from disk. Articles are effectively static per session.
+    # The wikipedia package calls requests.get() directly, so swap in the session.
+    session = requests_cache.CachedSession("wiki_cache", backend="sqlite", expire_after=3600)
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20)
+    session.mount("http://", adapter)  # the package's default API_URL is http://
+    session.mount("https://", adapter)
+    wikipedia.wikipedia.requests = session
+
+    return WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper())
+
+_WIKI_LOCK = threading.Lock()
+
+def _run_wiki_query(query: str) -> str:
+    with _WIKI_LOCK:  # concurrent first searches must not build the tool twice
+        wiki_tool = _get_wiki_tool()
+    return wiki_tool.run(query)
+
+# WikipediaQueryRun blocks on HTTP, so searches run on worker threads
+# to let both sides' lookups overlap on the event loop.
+_WIKI_POOL = ThreadPoolExecutor(max_workers=4)
+
+async def _search_wikipedia(query: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_WIKI_POOL, _run_wiki_query, query)
+
+# Each side's slant is added here rather than by the model, saving output tokens per call
+async def search_achievements(query: str) -> str:
+    """Searches Wikipedia for the positive side of a subject (achievements, legacy, honors)."""
+    return await _search_wikipedia(f"{query} achievements success legacy honors")
+
+async def search_controversies(query: str) -> str:
+    """Searches Wikipedia for the negative side of a subject (controversy, criticism, failures)."""
+    return await _search_wikipedia(f"{query} controversy criticism failures war crimes scandals")
+
 def append_to_state(tool_context: ToolContext, field: str, response: str) -> dict[str, str]:
     """Appends data to a specific state key (e.g., pos_data, neg_data)."""
-    existing_state = tool_context.state.get(field, [])
-    if isinstance(existing_state, str):
-        existing_state = [existing_state]
+    entries = tool_context.state.get(field) or []
+    if isinstance(entries, str):
+        entries = [entries]
     
-    # Add new data
-    new_data = existing_state + [response]
-    tool_context.state[field] = new_data
+    # Add new data as a fresh list: ADK keeps the assigned object in the event's
+    # state_delta, so appending in place would rewrite earlier events
+    tool_context.state[field] = [*entries, response]
     
-    logging.info(f"[Added to {field}] Length: {len(str(response))}")
+    logging.info("[Added to %s] entries=%d", field, len(entries) + 1)
     return {"status": "success", "message": f"Data appended to {field}"}
 
-def write_verdict_file(tool_context: ToolContext, filename: str, content: str) -> dict[str, str]:
-    """Saves the final verdict to a text file."""
-    directory = "court_records"
-    target_path = os.path.join(directory, filename)
-    os.makedirs(os.path.dirname(target_path), exist_ok=True)
-    with open(target_path, "w", encoding='utf-8') as f:
-        f.write(content)
-    return {"status": "success", "path": target_path}
+def set_topic(tool_context: ToolContext, topic: str) -> dict[str, str]:
+    """Saves the subject of the trial to TOPIC, replacing any earlier topic."""
+    tool_context.state["TOPIC"] = topic
+    logging.info("[TOPIC set] %s", topic)
+    return {"status": "success", "message": "TOPIC saved"}
+
+def record_evidence(tool_context: ToolContext, pos: str, neg: str) -> dict[str, str]:
+    """Saves the Admirer's and Critic's summaries to pos_data and neg_data in one call."""
+    if pos:
+        append_to_state(tool_context, "pos_data", pos)
+    if neg:
+        append_to_state(tool_context, "neg_data", neg)
+    return {"status": "success", "message": "Evidence appended to pos_data and neg_data"}
+
+COURT_RECORDS_DIR = "court_records"
+os.makedirs(COURT_RECORDS_DIR, exist_ok=True)
+
+# Verdict files being streamed, keyed by invocation so every run starts a fresh file
+_open_verdicts: dict[str, TextIO] = {}
+
+def verdict_filename(topic) -> str:
+    """Builds '<TOPIC>_verdict.txt' with spaces replaced by underscores."""
+    if isinstance(topic, list):
+        topic = topic[-1] if topic else ""
+    name = str(topic).strip().replace(" ", "_").replace(os.sep, "_") or "untitled"
+    return f"{name}_verdict.txt"
+
+def write_verdict_chunk(callback_context: CallbackContext, filename: str, chunk: str, final: bool = False) -> None:
+    """Appends a chunk of the verdict to its file, closing the file on the final chunk."""
+    target_path = os.path.join(COURT_RECORDS_DIR, filename)
+    f = _open_verdicts.get(callback_context.invocation_id)
+    if f is None:
+        f = _open_verdicts[callback_context.invocation_id] = open(target_path, "w", encoding='utf-8')
+    if chunk:
+        f.write(chunk)
+        f.flush()
+    if final:
+        f.close()
+        del _open_verdicts[callback_context.invocation_id]
+        callback_context.state["_verdict_written"] = target_path
+
+def stream_verdict_to_file(callback_context: CallbackContext, llm_response: LlmResponse) -> None:
+    """After-model callback: writes the verdict to disk as Gemini generates it."""
+    if not llm_response.content or not llm_response.content.parts:
+        return None
+    text = "".join(part.text for part in llm_response.content.parts if part.text and not part.thought)
+    filename = verdict_filename(callback_context.state.get("TOPIC", ""))
+
+    if llm_response.partial:
+        write_verdict_chunk(callback_context, filename, text)
+    else:
+        # The final response repeats the streamed text in full; write it only if nothing was streamed
+        streamed = callback_context.invocation_id in _open_verdicts
+        write_verdict_chunk(callback_context, filename, "" if streamed else text, final=True)
+    return None
+
+def close_failed_verdict(callback_context: CallbackContext, llm_request: LlmRequest, error: Exception) -> None:
+    """Model-error callback: drops the half-written verdict's file handle, then lets the error propagate."""
+    f = _open_verdicts.pop(callback_context.invocation_id, None)
+    if f is not None:
+        f.close()
+    return None
 
 # 3. AGENT DEFINITIONS
 
-# Parallel Agents
+_PLACEHOLDER = re.compile(r"{+([^{}]*)}+")
+_STATE_PREFIXES = (State.APP_PREFIX, State.USER_PREFIX, State.TEMP_PREFIX)
 
-# Agent A: The Admirer (Positive Side)
-admirer = Agent(
-    name="admirer",
-    model=get_gemini_model(),
-    description="Finds positive achievements and legacies.",
-    instruction="""
-    ROLE: You are 'The Admirer'. You verify the greatness of the subject.
-    
-    INPUT CONTEXT:
-    - Subject: { TOPIC? }
-    - Judge's Feedback (if any): { JUDGE_FEEDBACK? }
+def _is_state_name(name: str) -> bool:
+    # Same rule as ADK: an identifier, optionally behind an app:/user:/temp: prefix
+    prefix, sep, rest = name.partition(":")
+    if not sep:
+        return name.isidentifier()
+    return prefix + sep in _STATE_PREFIXES and rest.isidentifier()
 
-    INSTRUCTIONS:
-    1. Search Wikipedia for the Subject. **ALWAYS append keywords** like "achievements", "success", "legacy", "honors" to your search query to find positive aspects.
-    2. If there is JUDGE_FEEDBACK saying data is missing, search specifically for what is asked.
-    3. Summarize the **Positive** facts found.
-    4. Use tool 'append_to_state' to save your summary to the key 'pos_data'.
-    
-    IMPORTANT: Do NOT report controversies. Focus ONLY on the good side.
-    """,
-    tools=[
-        LangchainTool(tool=WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper())),
-        append_to_state
-    ]
-)
+def compile_instruction(template: str) -> Callable[[ReadonlyContext], str]:
+    """Parses an instruction's { key } / { key? } placeholders once, at import.
 
-# Agent B: The Critic (Negative Side)
-critic = Agent(
-    name="critic",
-    model=get_gemini_model(),
-    description="Finds controversies, failures, and criticisms.",
-    instruction="""
-    ROLE: You are 'The Critic'. You expose the flaws of the subject.
+    ADK re-scans string instructions with a regex on every model call; an
+    instruction provider skips that and only joins the pre-split pieces.
+    Brace groups that aren't state names (e.g. JSON examples) are kept as text,
+    as ADK does. { artifact.* } placeholders are not supported.
+    """
+    literals, keys = [], []
+    last_end = 0
+    for match in _PLACEHOLDER.finditer(template):
+        name = match.group(1).strip()
+        optional = name.endswith("?")
+        name = name.removesuffix("?")
+        if name.startswith("artifact."):
+            raise ValueError(f"Artifact placeholders aren't supported: {match.group()}")
+        if not _is_state_name(name):
+            continue
+        literals.append(template[last_end:match.start()])
+        keys.append((name, optional))
+        last_end = match.end()
+    literals.append(template[last_end:])
+
+    def render(context: ReadonlyContext) -> str:
+        out = [literals[0]]
+        for (key, optional), literal in zip(keys, literals[1:]):
+            if key in context.state:
+                value = context.state[key]
+                out.append("" if value is None else str(value))
+            elif not optional:
+                raise KeyError(f"Context variable not found: `{key}`")
+            out.append(literal)
+        return "".join(out)
+
+    return render
+
+# Investigation Team: both personas in one agent. This halves the number of Gemini calls
+# per iteration, but the calls now run one after another instead of in parallel.
+
+dual_investigator = Agent(
+    name="dual_investigator",
+    model=FAST_MODEL,
+    description="Investigates both sides of the history in a single pass.",
+    instruction=compile_instruction("""
+    ROLE: You are the Investigation Team. You argue BOTH sides of the trial in one pass.
     
     INPUT CONTEXT:
     - Subject: { TOPIC? }
     - Judge's Feedback (if any): { JUDGE_FEEDBACK? }
 
+    SIDE A - 'The Admirer': You verify the greatness of the subject.
+    - Search with 'search_achievements' using just the Subject (positive keywords are added for you).
+    - Summarize the **Positive** facts found. Do NOT report controversies.
+
+    SIDE B - 'The Critic': You expose the flaws of the subject.
+    - Search with 'search_controversies' using just the Subject (negative keywords are added for you).
+    - Summarize the **Negative** facts found. Do NOT report achievements.
+
     INSTRUCTIONS:
-    1. Search Wikipedia for the Subject. **ALWAYS append keywords** like "controversy", "criticism", "failures", "war crimes", "scandals" to your search query.
+    1. Run the searches for both sides (call both tools in the same turn).
     2. If there is JUDGE_FEEDBACK saying data is missing, search specifically for what is asked.
-    3. Summarize the **Negative** facts found.
-    4. Use tool 'append_to_state' to save your summary to the key 'neg_data'.
+    3. Use tool 'record_evidence' ONCE: 'pos' is the Admirer's summary, 'neg' is the Critic's summary.
+       Leave a side empty only if the Judge asked for the other side alone.
     
-    IMPORTANT: Do NOT report achievements. Focus ONLY on the bad side.
-    """,
+    IMPORTANT: Keep the two summaries strictly separate.
+    """),
     tools=[
-        LangchainTool(tool=WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper())),
-        append_to_state
-    ]
+        search_achievements,
+        search_controversies,
+        record_evidence
+    ],
+    generate_content_config=types.GenerateContentConfig(max_output_tokens=2048)
 )
 
-investigation_team = ParallelAgent(
-    name="investigation_team",
-    sub_agents=[admirer, critic],
-    description="Investigates both sides of the history simultaneously."
+# The Judge
+
+def evidence_hash(state) -> str:
+    """Fingerprints the current pos_data/neg_data so unchanged evidence can be spotted."""
+    evidence = {"p": state.get("pos_data", []), "n": state.get("neg_data", [])}
+    payload = json.dumps(evidence, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+class JudgeCache(BaseAgent):
+    """Ends the trial without calling the judge when the evidence hasn't changed since its last ruling."""
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        state_hash = evidence_hash(ctx.session.state)
+        if ctx.session.state.get("_last_judge_hash") == state_hash:
+            logging.info("[Judge cache] Evidence unchanged, accepting it")
+            yield Event(
+                invocation_id=ctx.invocation_id,
+                author=self.name,
+                branch=ctx.branch,
+                actions=EventActions(escalate=True),
+            )
+            return
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            actions=EventActions(state_delta={"_last_judge_hash": state_hash}),
+        )
+
+class BalanceGate(BaseAgent):
+    """Ends the trial without calling the judge once both sides clearly have enough evidence."""
+    min_entries: int = 2
+    min_length: int = 200
+
+    def _is_sufficient(self, entries) -> bool:
+        if isinstance(entries, str):
+            entries = [entries]
+        return len(entries) >= self.min_entries and min(len(str(e)) for e in entries) > self.min_length
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        state = ctx.session.state
+        if self._is_sufficient(state.get("pos_data", [])) and self._is_sufficient(state.get("neg_data", [])):
+            logging.info("[Balance gate] Both sides have enough evidence")
+            yield Event(
+                invocation_id=ctx.invocation_id,
+                author=self.name,
+                branch=ctx.branch,
+                actions=EventActions(escalate=True),
+            )
+
+balance_gate = BalanceGate(
+    name="balance_gate",
+    description="Ends the loop early when both sides already have enough evidence."
 )
 
-# The Judge
+judge_cache = JudgeCache(
+    name="judge_cache",
+    description="Skips the judge when no new evidence arrived."
+)
 
 judge = Agent(
     name="judge",
-    model=get_gemini_model(),
+    model=FAST_MODEL,
     description="Evaluates evidence and controls the loop.",
-    instruction="""
+    instruction=compile_instruction("""
     ROLE: You are 'The Judge'. You ensure a fair trial by checking if we have enough information from both sides.
 
     EVIDENCE:
@@ -162,8 +429,32 @@ judge = Agent(
     - IF data is balanced and sufficient:
       - Use 'exit_loop' tool to end the trial.
       - Pass a brief confirmation message (e.g., "Evidence accepted").
-    """,
-    tools=[append_to_state, exit_loop]
+    """),
+    tools=[append_to_state, exit_loop],
+    generate_content_config=types.GenerateContentConfig(max_output_tokens=256, temperature=0.2)
+)
+
+# Each trial starts from empty evidence, so a second topic in the same session
+# isn't judged (or waved through by the gates) on the previous topic's data
+class OpenTrial(BaseAgent):
+    """Clears the evidence, judge feedback and judge cache left over from an earlier trial."""
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            actions=EventActions(state_delta={
+                "pos_data": [],
+                "neg_data": [],
+                "JUDGE_FEEDBACK": [],
+                "_last_judge_hash": None,
+            }),
+        )
+
+open_trial = OpenTrial(
+    name="open_trial",
+    description="Resets the evidence before a new trial."
 )
 
 # Loop Controller
@@ -171,7 +462,9 @@ historical_court_loop = LoopAgent(
     name="historical_court_loop",
     description="Iterates the investigation until the Judge is satisfied.",
     sub_agents=[
-        investigation_team, # Step 2
+        dual_investigator,  # Step 2
+        balance_gate,       # Step 3 (ends the loop, skipping the judge, if both sides are already sufficient)
+        judge_cache,        # Step 3 (ends the loop, skipping the judge, if evidence is unchanged)
         judge               # Step 3
     ],
     max_iterations=3 # Limit loops to prevent infinite running
@@ -181,9 +474,9 @@ historical_court_loop = LoopAgent(
 
 verdict_writer = Agent(
     name="verdict_writer",
-    model=get_gemini_model(),
+    model=SMART_MODEL,
     description="Writes the final neutral report.",
-    instruction="""
+    instruction=compile_instruction("""
     ROLE: You are the Court Scribe.
     
     INPUT:
@@ -199,11 +492,11 @@ verdict_writer = Agent(
        - The Admirer's Argument (Pros)
        - The Critic's Argument (Cons)
        - Final Neutral Conclusion
-    4. Use 'write_verdict_file' tool to save it.
-       - Filename: "{TOPIC}_verdict.txt" (replace spaces with underscores).
-       - Content: The full report.
-    """,
-    tools=[write_verdict_file]
+    4. Reply with the full report only. It is saved to the court records as you write it.
+    """),
+    after_model_callback=stream_verdict_to_file,
+    on_model_error_callback=close_failed_verdict,
+    generate_content_config=types.GenerateContentConfig(max_output_tokens=4096, temperature=0.4)
 )
 
 # Main Orchestrator
@@ -212,6 +505,7 @@ court_system = SequentialAgent(
     name="court_system",
     description="Manages the flow of the historical court.",
     sub_agents=[
+        open_trial,            # Start from empty evidence
         historical_court_loop, # Run the trial loop
         verdict_writer         # Write final report
     ]
@@ -219,43 +513,104 @@ court_system = SequentialAgent(
 
 root_agent = Agent(
     name="clerk",
-    model=get_gemini_model(),
+    model=FAST_MODEL,
     description="Step 1: The Inquiry",
     instruction="""
     1. Greet the user to 'The Historical Court'.
     2. Ask the user for a **Historical Figure or Event** to put on trial.
-    3. Use 'append_to_state' to save the user's input to the key 'TOPIC'.
+    3. Use 'set_topic' to save the user's input as the TOPIC.
     4. Transfer control to the 'court_system'.
     """,
-    tools=[append_to_state],
+    tools=[set_topic],
     sub_agents=[court_system]
 )
 
 # 4. EXECUTION
-if __name__ == "__main__":
-    print(f"⚖️ The Historical Court is in session! (Model: {model_name})")
+
+EXIT_WORDS = {"exit", "quit", "ออก"}
+USER_ID = "user"
+
+def read_input(loop: asyncio.AbstractEventLoop, inputs: asyncio.Queue) -> None:
+    """Reads user lines on a daemon thread, so typing never waits for the agents."""
+    while True:
+        try:
+            user_input = input()
+        except EOFError:
+            user_input = "exit"
+        loop.call_soon_threadsafe(inputs.put_nowait, user_input)
+        if user_input.lower() in EXIT_WORDS:
+            return
+
+async def run_turn(runner: InMemoryRunner, session_id: str, user_input: str, run_config: RunConfig) -> None:
+    """Sends one message to the court, printing replies as they stream in."""
+    message = types.Content(role="user", parts=[types.Part(text=user_input)])
+    streaming = False
+    async for event in runner.run_async(user_id=USER_ID, session_id=session_id, new_message=message, run_config=run_config):
+        parts = event.content.parts if event.content and event.content.parts else []
+        text = "".join(part.text for part in parts if part.text and not part.thought)
+        if not text:
+            continue
+        if event.partial:
+            if not streaming:
+                print(f"\n{event.author}: ", end="")
+                streaming = True
+            print(text, end="", flush=True)
+            continue
+
+        # The final event repeats the text that was just streamed
+        if streaming:
+            print()
+            streaming = False
+        else:
+            print(f"\n{event.author}: {text}")
+
+async def main() -> threading.Thread:
+    print(f"⚖️ The Historical Court is in session! (Models: {CFG.fast_model_name} / {CFG.model_name})")
     print("System ready. Waiting for user input...")
-    
-    session_state = {}
-    
+
+    runner = InMemoryRunner(agent=root_agent, app_name="historical_court")
+    session = await runner.session_service.create_session(app_name=runner.app_name, user_id=USER_ID)
+    run_config = RunConfig(streaming_mode=StreamingMode.SSE)
+
+    # Input is read concurrently, so the user can type the next line while a verdict is generating
+    inputs: asyncio.Queue[str] = asyncio.Queue()
+    reader = threading.Thread(target=read_input, args=(asyncio.get_running_loop(), inputs), daemon=True)
+    reader.start()
+
     try:
         # Start conversation
-        response = root_agent.query(user_input=None, state=session_state)
-        print(f"\nClerk: {response.output_text}")
-        
+        await run_turn(runner, session.id, "Hello", run_config)
+
         while True:
-            user_input = input("\nYou: ")
-            if user_input.lower() in ["exit", "quit", "ออก"]:
+            print("\nYou: ", end="", flush=True)
+            user_input = await inputs.get()
+            if user_input.lower() in EXIT_WORDS:
                 break
-                
+
             # Send input to agents
-            response = root_agent.query(user_input=user_input, state=session_state)
-            print(f"\nSystem: {response.output_text}")
-            
+            await run_turn(runner, session.id, user_input, run_config)
+
             # Check if file is created
-            if "court_records" in str(response.output_text) or any("_verdict.txt" in str(v) for v in session_state.values()):
+            session = await runner.session_service.get_session(app_name=runner.app_name, user_id=USER_ID, session_id=session.id)
+            if session.state.get("_verdict_written"):
                 print("\n--- Court Adjourned. Verdict saved. ---")
+                # Clear the sentinel so a later topic reports only its own verdict
+                await runner.session_service.append_event(session, Event(
+                    author="user",
+                    actions=EventActions(state_delta={"_verdict_written": None}),
+                ))
                 # Optional: break or continue for new topic
-                
+
     except Exception as e:
         print(f"\n Error: {e}")
+    return reader
+
+if __name__ == "__main__":
+    reader = asyncio.run(main())
+    if reader.is_alive():
+        # The reader is still blocked in input(), which can't be interrupted, and would
+        # abort interpreter shutdown on stdin's lock. Flush and exit without finalizing.
+        sys.stdout.flush()
+        sys.stderr.flush()
+        logging.shutdown()
+        os._exit(0)